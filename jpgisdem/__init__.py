@@ -1,14 +1,16 @@
+import concurrent.futures
+import functools
+import io
 import os
-import random
 import shutil
-import string
 import tempfile
 import zipfile
 
 import click
 import numpy as np
 import rasterio
-import rasterio.merge
+import rasterio.shutil
+import rasterio.windows
 from lxml import etree
 
 __version__ = "0.0.6"
@@ -19,87 +21,147 @@ __version__ = "0.0.6"
 NODATA_VALUE = -9999.0
 
 
-# Save output as a compressed cloud-optimised geotiff.
-COG_PROFILE = {
+# Size of the square geotiff tiles. Rasters are also written in bands of this
+# many rows, so each write covers whole tiles.
+BLOCK_SIZE = 512
+
+
+# Rasters are first written a band at a time to an uncompressed tiled geotiff.
+# The COG driver can only copy an existing raster (writing to it directly
+# buffers the whole raster in memory), so this is then copied to the output.
+GTIFF_PROFILE = {
     "count": 1,
     "driver": "GTiff",
     "dtype": np.float32,
-    "compress": "deflate",
     "tiled": True,
-    "blockxsize": 512,
-    "blockysize": 512,
-    "interleave": "pixel",
+    "blockxsize": BLOCK_SIZE,
+    "blockysize": BLOCK_SIZE,
     "nodata": NODATA_VALUE,
 }
 
 
-def _random_string(n=16):
-    return "".join(random.choices(string.ascii_lowercase, k=n))
+# Save output as a compressed cloud-optimised geotiff, using GDAL's COG driver
+# so tile and overview layout are valid COG. LERC with a max error of 2e-5 is
+# effectively lossless for DEM data given in cm, and smaller than deflate.
+# Tiles are compressed on all cores.
+COG_PROFILE = {
+    "driver": "COG",
+    "compress": "lerc_zstd",
+    "max_z_error": 2e-5,
+    "blocksize": BLOCK_SIZE,
+    "overviews": "auto",
+    "num_threads": "all_cpus",
+}
+
+
+# Elements whose text is needed from the xml file.
+GML_ELEMENTS = {
+    "lowerCorner",
+    "upperCorner",
+    "low",
+    "high",
+    "axisLabels",
+    "startPoint",
+    "tupleList",
+}
+
+# All the needed elements are in the GML namespace.
+GML_NAMESPACE = "http://www.opengis.net/gml/3.2"
 
+# Elements describing the raster grid, which come before the tupleList.
+GML_HEADER_ELEMENTS = GML_ELEMENTS - {"startPoint", "tupleList"}
 
-def _tmp_path(tmp_folder, extension=""):
-    if extension and not extension.startswith("."):
-        extension = "." + extension
-    os.makedirs(tmp_folder, exist_ok=True)
-    filename = _random_string(16) + extension
-    path = os.path.join(tmp_folder, filename)
-    return path
+# iterparse tag filters for the needed elements (and the Envelope, for its
+# srsName attribute). Built once at import.
+GML_TAGS = [
+    etree.QName(GML_NAMESPACE, name).text
+    for name in ["Envelope"] + sorted(GML_ELEMENTS)
+]
+GML_HEADER_TAGS = [
+    etree.QName(GML_NAMESPACE, name).text
+    for name in ["Envelope"] + sorted(GML_HEADER_ELEMENTS)
+]
 
 
-def _load_xml(fh):
+def _binary_file(fh):
+    """Get a binary filehandle for fh.
+
+    lxml and zipfile need bytes: text-mode handles are read through their
+    underlying buffer.
+    """
+    return getattr(fh, "buffer", fh)
+
+
+def _load_xml(fh, name=None, tags=GML_TAGS):
     """Parse the xml file.
 
+    The file is streamed rather than loaded into a full tree: only the text
+    of the few elements needed to build the raster is kept, and each element
+    is discarded once it has been read.
+
     Args:
         fh: File handle to an xml file (for a zipped xml file).
+        name: name of the file for error messages. Defaults to fh.name, if
+            any.
+        tags: iterparse tag filter of the elements to read. Parsing stops
+            once they have all been found.
 
     Returns:
-        root: Root node of ElementTree.
+        gml: dict of the raw strings needed from the DEM, keyed by element
+            name (and "srsName" for the Envelope attribute). Elements without
+            text are left out.
     """
+    name = name or getattr(fh, "name", "<xml>")
+    gml = {}
+    seen = set()
     try:
-
-        # For zip files, parse the first file in the zipped directory.
-        # if fh.name.lower().endswith(".zip"):
-        #     archive = zipfile.ZipFile(fh)
-        #     items = archive.namelist()[0]
-        #     with archive.open(items) as fhz:
-        #         tree = etree.parse(fhz, parser=etree.XMLParser(huge_tree=True))
-        # else:
-        tree = etree.parse(fh, parser=etree.XMLParser(huge_tree=True))
-
-        root = tree.getroot()
-
-        # Remove namespace.
-        # From https://stackoverflow.com/questions/18159221/remove-namespace-and-prefix-from-xml-in-python-using-lxml
-        for elem in root.getiterator():
-            if not (
-                isinstance(elem, etree._Comment)
-                or isinstance(elem, etree._ProcessingInstruction)
-            ):
-                elem.tag = etree.QName(elem).localname
-        etree.cleanup_namespaces(root)
-
-        return root
-
+        for _, elem in etree.iterparse(
+            _binary_file(fh), events=("end",), tag=tags, huge_tree=True
+        ):
+            tag = etree.QName(elem).localname
+            if tag in seen:
+                raise click.ClickException(
+                    f"Unable to parse '{name}'. Found multiple {tag} elements."
+                )
+            seen.add(tag)
+
+            if tag == "Envelope":
+                key, value = "srsName", elem.get("srsName")
+            else:
+                key, value = tag, elem.text
+            if value is not None:
+                gml[key] = value
+
+            # Free the memory of elements that have been processed.
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+            if len(seen) == len(tags):
+                break
+
+    except click.ClickException:
+        raise
     except Exception as e:
-        raise click.ClickException(
-            f"Unable to parse '{fh.name}'. Is it a valid xml file?"
-        )
+        raise click.ClickException(f"Unable to parse '{name}'. Is it a valid xml file?")
 
+    return gml
 
-def _parse_crs(root):
+
+def _parse_crs(gml):
     """Find the coordinate system on the xml.
 
     DEM files are either jgd2011 or jgd2000 (which are similar within a few metres for Japan).
 
     Args:
-        root: ElementTree of xml document.
+        gml: dict of strings from xml document.
 
     Returns:
         crs: rasterio CRS object.
     """
     try:
-        gml_srs = root.xpath("DEM/coverage/boundedBy/Envelope/@srsName")[0]
-    except IndexError:
+        gml_srs = gml["srsName"]
+    except KeyError:
         raise click.ClickException("Unable to find srs. Is this a JPGIS GML DEM file?")
 
     if gml_srs == "fguuid:jgd2011.bl":
@@ -109,37 +171,37 @@ def _parse_crs(root):
     else:
         raise click.ClickException(f"Unsupported srs: '{gml_srs}'.")
 
-    crs = rasterio.crs.CRS.from_epsg(epsg)
+    crs = _crs_from_epsg(epsg)
 
     return crs
 
 
-def _parse_shape(root):
+@functools.lru_cache()
+def _crs_from_epsg(epsg):
+    """Build a rasterio CRS, cached as every tile shares one of two CRSs."""
+    return rasterio.crs.CRS.from_epsg(epsg)
+
+
+def _parse_shape(gml):
     """Get the shape of the array from the xml file.
 
     Args:
-        root: ElementTree of xml document.
+        gml: dict of strings from xml document.
 
     Returns:
         height, width: Ingeger shape.
     """
     try:
-        gml_grid_low = root.xpath(
-            "DEM/coverage/gridDomain/Grid/limits/GridEnvelope/low"
-        )[0].text
-        gml_grid_high = root.xpath(
-            "DEM/coverage/gridDomain/Grid/limits/GridEnvelope/high"
-        )[0].text
-        gml_labels = root.xpath("DEM/coverage/gridDomain/Grid/axisLabels")[0].text
-    except IndexError:
+        gml_grid_low = gml["low"]
+        gml_grid_high = gml["high"]
+        gml_labels = gml["axisLabels"]
+    except KeyError:
         raise click.ClickException("Unable to find GridEnvelope shape.")
 
     try:
-        assert gml_labels == "x y", "Unknown format"
-        xmin = int(gml_grid_low.split(" ")[0])
-        ymin = int(gml_grid_low.split(" ")[1])
-        xmax = int(gml_grid_high.split(" ")[0])
-        ymax = int(gml_grid_high.split(" ")[1])
+        assert gml_labels.split() == ["x", "y"], "Unknown format"
+        xmin, ymin = map(int, gml_grid_low.split())
+        xmax, ymax = map(int, gml_grid_high.split())
 
         assert xmin == 0
         assert ymin == 0
@@ -152,30 +214,24 @@ def _parse_shape(root):
     return height, width
 
 
-def _parse_bounds(root):
+def _parse_bounds(gml):
     """Find the bounds of the raster, in the crs.
 
     Args:
-        root: ElementTree of xml document.
+        gml: dict of strings from xml document.
 
     Returns:
         bounds: rasterio BoundingBox.
     """
     try:
-        gml_lower_corner = root.xpath("DEM/coverage/boundedBy/Envelope/lowerCorner")[
-            0
-        ].text  # SW
-        gml_upper_corner = root.xpath("DEM/coverage/boundedBy/Envelope/upperCorner")[
-            0
-        ].text  # NE
-    except IndexError:
+        gml_lower_corner = gml["lowerCorner"]  # SW
+        gml_upper_corner = gml["upperCorner"]  # NE
+    except KeyError:
         raise click.ClickException("Unable to find Envelope bounds.")
 
     try:
-        bottom = float(gml_lower_corner.split(" ")[0])
-        left = float(gml_lower_corner.split(" ")[1])
-        top = float(gml_upper_corner.split(" ")[0])
-        right = float(gml_upper_corner.split(" ")[1])
+        bottom, left = map(float, gml_lower_corner.split())
+        top, right = map(float, gml_upper_corner.split())
         bounds = rasterio.coords.BoundingBox(left, bottom, right, top)
     except Exception as e:
         raise click.ClickException("Unable to parse Envelope bounds.")
@@ -183,125 +239,302 @@ def _parse_bounds(root):
     return bounds
 
 
-def _load_start_data(root, height, width):
-    """Load 'compressed' elevation data at the start of the array.
+def _parse_start_index(gml, width):
+    """Find the index of the first tupleList value in the flattened array.
 
     When the raster starts with NULL data, this is encoded by a starting
     offset, rather than including each individual value.
 
-    This function reads the offset and makes a NODATA array of that length.
-
     Args:
-        root: ElementTree of xml document.
+        gml: dict of strings from xml document.
+        width: raster width.
 
     Returns:
-        data: numpy array, all NODATA values, of the appropriate length.
+        n_start: number of NODATA cells before the first value.
     """
     try:
-        gml_startpoint = root.xpath(
-            "DEM/coverage/coverageFunction/GridFunction/startPoint"
-        )[0].text
-        x_start = int(gml_startpoint.split(" ")[0])
-        y_start = int(gml_startpoint.split(" ")[1])
+        gml_startpoint = gml["startPoint"]
+        x_start, y_start = map(int, gml_startpoint.split())
     except Exception as e:
         raise click.ClickException("Unable to parse startPoint.")
 
     n_start = width * y_start + x_start
-    data = np.zeros(n_start, dtype=np.float32) + NODATA_VALUE
-    return data
+    return n_start
 
 
-def _load_main_data(root):
+def _load_main_data(gml):
     """Load main data.
 
-    Reads xml data line by line.
+    Each line of the tupleList is a `flag,value` pair: only the value column
+    is parsed, using numpy's C parser.
 
     Args:
-        root: ElementTree of xml document.
+        gml: dict of strings from xml document.
 
     Returns:
         data: numpy array.
     """
     try:
-        gml_data = root.xpath("DEM/coverage/rangeSet/DataBlock/tupleList")[0].text
-        tuple_strings = gml_data.strip().split("\n")
-        data_strings = [t.split(",")[-1] for t in tuple_strings]
-        data = np.array(data_strings, dtype=np.float32)
+        gml_data = gml["tupleList"]
+        data = np.loadtxt(
+            io.StringIO(gml_data.strip()),
+            delimiter=",",
+            usecols=1,
+            ndmin=1,
+            dtype=np.float32,
+        )
     except Exception as e:
         raise click.ClickException("Unable to parse main data.")
     return data
 
 
-def _merge_data(start_data, main_data, height, width):
-    """Generate full 2D raster data.
+def _iter_bands(n_start, main_data, height, width):
+    """Generate 2D raster data, a band of rows at a time.
+
+    Each band has main_data copied in after n_start cells of leading NODATA,
+    with any remaining cells padded with trailing NODATA. Only one band is
+    built at a time, so a single-file raster is written by _write_cog
+    without ever holding the full 2D array. The same buffer is reused for
+    every band, so each band must be consumed before the next is requested.
 
-    Concatenates start_data and main_data, then pads with trailing data to
-    match desired shape.
+    NODATA cells are left as NODATA_VALUE, which is the nodata value of the
+    output geotiff, so no conversion to NaN is needed.
 
     Args:
-        start_data: array of any NODATA values at start of file.
-        main_data: array of sunsequent values.
+        n_start: number of NODATA cells at start of file.
+        main_data: array of subsequent values.
         height, width: raster shape.
 
-    Returns:
-        array: 2D raster data.
+    Yields:
+        row, band: index of the first row of the band, and 2D band data of
+            up to BLOCK_SIZE rows.
     """
-    # Merge.
-    data = np.concatenate([start_data, main_data])
+    n_cells = height * width
+    n_end = n_start + len(main_data)
+    if n_end > n_cells:
+        raise click.ClickException(f"Data size {n_end} exceedes desired size {n_cells}")
 
-    # Handle NODATA.
-    data[data == NODATA_VALUE] = np.nan
+    buffer = np.empty((min(BLOCK_SIZE, height), width), dtype=np.float32)
+    for row in range(0, height, BLOCK_SIZE):
+        band = buffer[: min(BLOCK_SIZE, height - row)]
+        data = band.reshape(-1)
 
-    # Pad out to full size.
-    n_cells = height * width
-    if len(data) > n_cells:
-        raise click.ClickException(
-            f"Data size {len(data)} exceedes desired size {n_cells}"
-        )
-    if len(data) < n_cells:
-        end_data = np.empty(n_cells - len(data), dtype=np.float32)
-        end_data[:] = np.nan
-        data = np.concatenate([data, end_data])
+        # Cell range of the band, and the part of it covered by main_data.
+        i_band = row * width
+        i_start = min(max(n_start - i_band, 0), data.size)
+        i_end = min(max(n_end - i_band, 0), data.size)
 
-    # Reshape to square.
-    assert len(data) == n_cells
-    array = data.reshape((height, width))
+        data[:i_start] = NODATA_VALUE
+        data[i_start:i_end] = main_data[
+            i_band + i_start - n_start : i_band + i_end - n_start
+        ]
+        data[i_end:] = NODATA_VALUE
 
-    return array
+        yield row, band
 
 
-def _xml2tif_single_file(src_file, dst_file):
-    """Rasterise a GML xml file.
+def _parse_tile(src_file, name=None):
+    """Load and parse a GML xml file.
 
     Args:
         src_file: filehandle of xml file.
-        dst_file: filehandle of geotiff to write to.
+        name: name of the file for error messages. Defaults to src_file.name.
+
+    Returns:
+        crs: rasterio CRS object.
+        bounds: rasterio BoundingBox.
+        height, width: raster shape.
+        n_start: number of NODATA cells at start of file.
+        main_data: array of subsequent values.
     """
     # Load file.
-    root = _load_xml(src_file)
+    gml = _load_xml(src_file, name)
 
     # Parse file.
-    crs = _parse_crs(root)
-    height, width = _parse_shape(root)
-    bounds = _parse_bounds(root)
+    crs = _parse_crs(gml)
+    height, width = _parse_shape(gml)
+    bounds = _parse_bounds(gml)
 
     # Load data.
-    start_data = _load_start_data(root, height, width)
-    main_data = _load_main_data(root)
+    n_start = _parse_start_index(gml, width)
+    main_data = _load_main_data(gml)
 
-    # Reshape data into a 2d array.
-    array = _merge_data(start_data, main_data, height, width)
-    del start_data, main_data
+    return crs, bounds, height, width, n_start, main_data
 
-    # Save as tif.
-    transform = rasterio.transform.from_bounds(
-        bounds.left, bounds.bottom, bounds.right, bounds.top, width, height
-    )
+
+def _parse_tile_path(xml_path, name):
+    """Load and parse a GML xml file from a path.
+
+    Takes a path rather than a filehandle so it can be run in a worker process.
+
+    Args:
+        xml_path: path of xml file.
+        name: name of the file for error messages, e.g. the zip member name
+            rather than the path it was extracted to.
+
+    Returns:
+        tile: tuple as returned by _parse_tile.
+    """
+    with open(xml_path, "rb") as f:
+        return _parse_tile(f, name)
+
+
+def _parse_tile_header(src_file, name=None):
+    """Parse the georeferencing of a GML xml file, without loading its data.
+
+    Only the start of the file is read, up to the grid description.
+
+    Args:
+        src_file: filehandle of xml file.
+        name: name of the file for error messages. Defaults to src_file.name.
+
+    Returns:
+        crs: rasterio CRS object.
+        bounds: rasterio BoundingBox.
+        height, width: raster shape.
+    """
+    gml = _load_xml(src_file, name, GML_HEADER_TAGS)
+    crs = _parse_crs(gml)
+    height, width = _parse_shape(gml)
+    bounds = _parse_bounds(gml)
+    return crs, bounds, height, width
+
+
+def _merge_extent(headers):
+    """Find the extent of the merged raster of several tiles.
+
+    The extent is the union of the tile bounds, at the resolution of the
+    first tile.
+
+    Args:
+        headers: list of tuples as returned by _parse_tile_header.
+
+    Returns:
+        crs: rasterio CRS object.
+        transform: affine transform of the merged raster.
+        height, width: merged raster shape.
+    """
+    # Check all have the same crs and resolution.
+    crs, bounds, height, width = headers[0]
+    xres = (bounds.right - bounds.left) / width
+    yres = (bounds.top - bounds.bottom) / height
+    for tile_crs, tile_bounds, tile_height, tile_width in headers:
+        if tile_crs != crs:
+            raise click.ClickException(
+                "ZIP file contains XML rasters wih differing reference systems."
+            )
+        tile_xres = (tile_bounds.right - tile_bounds.left) / tile_width
+        tile_yres = (tile_bounds.top - tile_bounds.bottom) / tile_height
+        if not np.isclose(tile_xres, xres) or not np.isclose(tile_yres, yres):
+            raise click.ClickException(
+                "ZIP file contains XML rasters wih differing resolutions."
+            )
+
+    left = min(header[1].left for header in headers)
+    bottom = min(header[1].bottom for header in headers)
+    right = max(header[1].right for header in headers)
+    top = max(header[1].top for header in headers)
+    transform = rasterio.transform.from_origin(left, top, xres, yres)
+    width = int(round((right - left) / xres))
+    height = int(round((top - bottom) / yres))
+
+    return crs, transform, height, width
+
+
+def _merge_tiles(extent, tiles):
+    """Merge parsed tiles into a single 2D raster.
+
+    Each tile is copied straight into its slice of the output array. Tiles
+    are consumed one at a time, so each can be released once it has been
+    copied. Where tiles overlap, the first valid value is kept.
+
+    Args:
+        extent: tuple as returned by _merge_extent.
+        tiles: iterable of tuples as returned by _parse_tile.
+
+    Returns:
+        dest: 2D raster data.
+    """
+    _, transform, height, width = extent
+    dest = np.full((height, width), NODATA_VALUE, dtype=np.float32)
+    for tile in tiles:
+        _, bounds, tile_height, tile_width, n_start, main_data = tile
+        col_offset, row_offset = ~transform * (bounds.left, bounds.top)
+        col_offset = int(round(col_offset))
+        row_offset = int(round(row_offset))
+        for row, band in _iter_bands(n_start, main_data, tile_height, tile_width):
+            row_start = row_offset + row
+            row_end = row_start + band.shape[0]
+            region = dest[row_start:row_end, col_offset : col_offset + tile_width]
+            mask = region == NODATA_VALUE
+            region[mask] = band[mask]
+        del tile, main_data
+
+    return dest
+
+
+def _write_cog(dst_file, bands, height, width, crs, transform):
+    """Save raster data, generated a band at a time, as a cloud-optimised geotiff.
+
+    The bands are written to a tmp tiled geotiff, which is then copied with
+    the COG driver. Neither step holds the full raster in memory.
+
+    Args:
+        dst_file: filehandle or path of geotiff to write to.
+        bands: iterable of (row, band) pairs as generated by _iter_bands.
+        height, width: raster shape.
+        crs: rasterio CRS object.
+        transform: affine transform of the raster.
+    """
+    try:
+        tmp_folder = tempfile.mkdtemp()
+        tmp_path = os.path.join(tmp_folder, "raster.tif")
+        with rasterio.open(
+            tmp_path,
+            "w",
+            width=width,
+            height=height,
+            crs=crs,
+            transform=transform,
+            **GTIFF_PROFILE,
+        ) as f:
+            for row, band in bands:
+                window = rasterio.windows.Window(0, row, width, band.shape[0])
+                f.write(band, 1, window=window)
+
+        if hasattr(dst_file, "write"):
+            cog_path = os.path.join(tmp_folder, "cog.tif")
+            rasterio.shutil.copy(tmp_path, cog_path, **COG_PROFILE)
+            with open(cog_path, "rb") as f:
+                shutil.copyfileobj(f, dst_file)
+        else:
+            rasterio.shutil.copy(tmp_path, dst_file, **COG_PROFILE)
+
+    finally:
+        if os.path.exists(tmp_folder):
+            shutil.rmtree(tmp_folder)
+
+
+def _write_cog_array(dst_file, array, crs, transform):
+    """Save a 2D array as a cloud-optimised geotiff.
+
+    The array is already in memory, so it's written with the COG driver
+    directly, with no tmp files.
+
+    Args:
+        dst_file: filehandle or path of geotiff to write to.
+        array: 2D raster data.
+        crs: rasterio CRS object.
+        transform: affine transform of the raster.
+    """
     with rasterio.open(
         dst_file,
         "w",
-        width=width,
-        height=height,
+        width=array.shape[1],
+        height=array.shape[0],
+        count=1,
+        dtype=np.float32,
+        nodata=NODATA_VALUE,
         crs=crs,
         transform=transform,
         **COG_PROFILE,
@@ -309,6 +542,23 @@ def _xml2tif_single_file(src_file, dst_file):
         f.write(array, 1)
 
 
+def _xml2tif_single_file(src_file, dst_file):
+    """Rasterise a GML xml file.
+
+    Args:
+        src_file: filehandle of xml file.
+        dst_file: filehandle of geotiff to write to.
+    """
+    crs, bounds, height, width, n_start, main_data = _parse_tile(src_file)
+
+    # Save as tif.
+    transform = rasterio.transform.from_bounds(
+        bounds.left, bounds.bottom, bounds.right, bounds.top, width, height
+    )
+    bands = _iter_bands(n_start, main_data, height, width)
+    _write_cog(dst_file, bands, height, width, crs, transform)
+
+
 @click.group()
 def cli():
     pass
@@ -328,8 +578,8 @@ def _xml2tif(src_file, dst_file):
         return _xml2tif_single_file(src_file, dst_file)
 
     # If single-file zip, parse as normal.
-    archive = zipfile.ZipFile(src_file.name)
-    items = archive.namelist()
+    archive = zipfile.ZipFile(_binary_file(src_file))
+    items = [info for info in archive.infolist() if not info.is_dir()]
     n_items = len(items)
     if n_items == 0:
         raise (click.ClickException("Empty zip."))
@@ -337,45 +587,35 @@ def _xml2tif(src_file, dst_file):
         with archive.open(items[0]) as fhz:
             return _xml2tif_single_file(fhz, dst_file)
 
-    # If multiple file zip, convert each individually, then merge together.
-    try:
+    # If multiple file zip, parse each individually, then merge together.
+    # The headers are read first, to check the tiles are compatible and size
+    # the merged raster before parsing any data.
+    headers = []
+    for item in items:
+        with archive.open(item) as fhz:
+            headers.append(_parse_tile_header(fhz))
+    extent = _merge_extent(headers)
+    crs, transform, height, width = extent
 
-        # Setup.
+    try:
         tmp_folder = tempfile.mkdtemp()
-        tif_paths = [_tmp_path(tmp_folder, ".tif") for _ in range(n_items)]
-
-        # Build individual tmp rasters.
-        for xml_path, tif_path in zip(items, tif_paths):
-            with archive.open(xml_path) as fhz:
-                _xml2tif_single_file(fhz, tif_path)
-
-        # Check all have the same crs.
-        epsgs = []
-        for p in tif_paths:
-            with rasterio.open(p) as f:
-                epsgs.append(f.crs.to_epsg())
-        if len(set(epsgs)) > 1:
-            raise click.ClickException(
-                "ZIP file contains XML rasters wih differing reference systems."
-            )
-
-        # Merge rasters.
-        dest, transform = rasterio.merge.merge(tif_paths, nodata=NODATA_VALUE)
-        dest = dest[0]
-        with rasterio.open(
-            dst_file,
-            "w",
-            width=dest.shape[1],
-            height=dest.shape[0],
-            crs=f"epsg:{epsgs[0]}",
-            transform=transform,
-            **COG_PROFILE,
-        ) as f:
-            f.write(dest, 1)
-
+        xml_paths = [archive.extract(item, tmp_folder) for item in items]
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+
+            # Start the largest files first, to balance load across workers.
+            # Tiles are still merged in zip order, each as soon as it's ready.
+            by_size = sorted(range(n_items), key=lambda i: -items[i].file_size)
+            futures = {
+                i: executor.submit(_parse_tile_path, xml_paths[i], items[i].filename)
+                for i in by_size
+            }
+            tiles = (futures.pop(i).result() for i in range(n_items))
+            dest = _merge_tiles(extent, tiles)
     finally:
         if os.path.exists(tmp_folder):
             shutil.rmtree(tmp_folder)
 
+    _write_cog_array(dst_file, dest, crs, transform)
+
 
 cli.add_command(xml2tif)
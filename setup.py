@@ -35,7 +35,6 @@ setup(
     license="The MIT License",
     package_data={"": ["LICENSE", "README.md"]},
     packages=find_packages(),
-    py_modules=["jpgisdem"],
     install_requires=[
         "Click",
     ],
@@ -1,10 +1,14 @@
 import hashlib
+import io
 import os
 import shutil
+import zipfile
 
+import click
 import numpy as np
 import pytest
 import rasterio
+import rasterio.merge
 
 import jpgisdem
 
@@ -30,6 +34,18 @@ class TestXML2TIF:
             jpgisdem._xml2tif(src, dst)
         assert os.path.exists(dst_path)
 
+        with rasterio.open(dst_path) as f:
+            assert f.nodata == jpgisdem.NODATA_VALUE
+            a = f.read(1)
+
+        # Leading padding up to the startPoint (743, 639), then trailing
+        # padding after the last tupleList value.
+        assert (a[:639] == jpgisdem.NODATA_VALUE).all()
+        assert (a[639, :743] == jpgisdem.NODATA_VALUE).all()
+        max_z_error = jpgisdem.COG_PROFILE["max_z_error"]
+        assert a[639, 743] == pytest.approx(1.2, abs=max_z_error)
+        assert (a[-1] == jpgisdem.NODATA_VALUE).all()
+
     def test_zip_file(self, tidy_tmp_dir):
         dst_path = os.path.join(TMP_DIR, "out.tif")
         with open(SINGLE_ZIP_PATH) as src, open(dst_path, "wb") as dst:
@@ -57,5 +73,247 @@ class TestXML2TIF:
         with rasterio.open(dst_path) as f:
             assert f.width == 675
             assert f.height == 450
+            assert f.nodata == jpgisdem.NODATA_VALUE
+            a = f.read(1)
+            assert (a != jpgisdem.NODATA_VALUE).sum() > 0
+
+            # Leading padding before the startPoint of the top-left tile.
+            assert (a[0, :88] == jpgisdem.NODATA_VALUE).all()
+            assert a[0, 88] != jpgisdem.NODATA_VALUE
+
+            # The zip has no bottom-right tile.
+            assert (a[300:, 450:] == jpgisdem.NODATA_VALUE).all()
+
+    def test_zip_with_folder_entry(self, tmp_path, monkeypatch):
+        zip_path = tmp_path / "folder.zip"
+        with zipfile.ZipFile(zip_path, "w") as archive:
+            archive.writestr("dem/", "")
+            archive.write(XML_PATH, "dem/dem.xml")
+
+        calls = []
+        single_file = jpgisdem._xml2tif_single_file
+        monkeypatch.setattr(
+            jpgisdem,
+            "_xml2tif_single_file",
+            lambda src, dst: calls.append(src.name) or single_file(src, dst),
+        )
+
+        dst_path = str(tmp_path / "out.tif")
+        with open(zip_path, "rb") as src:
+            jpgisdem._xml2tif(src, dst_path)
+        assert calls == ["dem/dem.xml"]
+
+        with rasterio.open(dst_path) as f:
+            assert (f.height, f.width) == (750, 1125)
+
+    def test_multi_zip_bad_member(self, tmp_path):
+        with open(XML_PATH, "rb") as f:
+            xml = f.read()
+        zip_path = tmp_path / "bad.zip"
+        with zipfile.ZipFile(zip_path, "w") as archive:
+            archive.writestr("good.xml", xml)
+            archive.writestr("truncated.xml", xml[: len(xml) // 2])
+
+        with open(zip_path, "rb") as src:
+            with pytest.raises(click.ClickException) as e:
+                jpgisdem._xml2tif(src, str(tmp_path / "out.tif"))
+        assert "'truncated.xml'" in e.value.message
+
+
+class TestLoadXML:
+    def _write_xml(self, tmp_path, old, new):
+        with open(XML_PATH, encoding="utf-8") as f:
+            text = f.read()
+        assert old in text
+        path = tmp_path / "dem.xml"
+        path.write_text(text.replace(old, new), encoding="utf-8")
+        return path
+
+    def test_missing_srs(self, tmp_path):
+        path = self._write_xml(tmp_path, ' srsName="fguuid:jgd2011.bl"', "")
+        with open(path, "rb") as f:
+            gml = jpgisdem._load_xml(f)
+        assert "srsName" not in gml
+        with pytest.raises(click.ClickException, match="Unable to find srs"):
+            jpgisdem._parse_crs(gml)
+
+    def test_unnamed_filehandle(self):
+        with open(XML_PATH, "rb") as f:
+            gml = jpgisdem._load_xml(io.BytesIO(f.read()))
+        assert gml["srsName"] == "fguuid:jgd2011.bl"
+
+        with pytest.raises(click.ClickException, match="'<xml>'"):
+            jpgisdem._load_xml(io.BytesIO(b"not xml"))
+
+    def test_duplicate_element(self, tmp_path):
+        path = self._write_xml(
+            tmp_path,
+            "<gml:low>0 0</gml:low>",
+            "<gml:low>0 0</gml:low><gml:low>5 5</gml:low>",
+        )
+        with open(path, "rb") as f:
+            with pytest.raises(click.ClickException, match="multiple low elements"):
+                jpgisdem._load_xml(f)
+
+    def test_other_namespace_ignored(self, tmp_path):
+        path = self._write_xml(
+            tmp_path,
+            "<mesh>392676</mesh>",
+            '<mesh>392676</mesh><low xmlns="urn:other">5 5</low>',
+        )
+        with open(path, "rb") as f:
+            gml = jpgisdem._load_xml(f)
+        assert gml["low"] == "0 0"
+
+
+class TestIterBands:
+    @pytest.mark.parametrize(
+        "n_start, n_main, height, width",
+        [
+            (0, 0, 1, 1),
+            (0, 6, 2, 3),
+            (5, 10, 1100, 7),
+            (3580, 3000, 1100, 7),
+            (0, 7700, 1100, 7),
+            (7699, 1, 1100, 7),
+        ],
+    )
+    def test_matches_full_array(self, n_start, n_main, height, width):
+        main_data = np.arange(1, n_main + 1, dtype=np.float32)
+        expected = np.full(height * width, jpgisdem.NODATA_VALUE, dtype=np.float32)
+        expected[n_start : n_start + n_main] = main_data
+        expected = expected.reshape((height, width))
+
+        array = np.empty((height, width), dtype=np.float32)
+        n_rows = 0
+        for row, band in jpgisdem._iter_bands(n_start, main_data, height, width):
+            assert row == n_rows
+            assert band.shape[0] <= jpgisdem.BLOCK_SIZE
+            array[row : row + band.shape[0]] = band
+            n_rows += band.shape[0]
+
+        assert n_rows == height
+        assert np.array_equal(array, expected)
+
+    def test_too_much_data(self):
+        main_data = np.zeros(10, dtype=np.float32)
+        with pytest.raises(click.ClickException):
+            list(jpgisdem._iter_bands(1, main_data, 2, 5))
+
+
+class TestMergeTiles:
+    CRS = rasterio.crs.CRS.from_epsg(6668)
+
+    def _tile(self, left, top, data, res=1.0):
+        height, width = data.shape
+        bounds = rasterio.coords.BoundingBox(
+            left, top - height * res, left + width * res, top
+        )
+        main_data = data.reshape(-1).astype(np.float32)
+        return self.CRS, bounds, height, width, 0, main_data
+
+    def test_multi_zip_matches_rasterio_merge(self, tmp_path):
+        dst_path = str(tmp_path / "merged.tif")
+        with open(MULTI_ZIP_PATH, "rb") as src:
+            jpgisdem._xml2tif(src, dst_path)
+
+        # Convert each tile individually, then merge with rasterio.
+        tile_paths = []
+        with zipfile.ZipFile(MULTI_ZIP_PATH) as archive:
+            for i, item in enumerate(archive.infolist()):
+                tile_path = str(tmp_path / f"{i}.tif")
+                with archive.open(item) as fhz:
+                    jpgisdem._xml2tif_single_file(fhz, tile_path)
+                tile_paths.append(tile_path)
+        expected, transform = rasterio.merge.merge(
+            tile_paths, nodata=jpgisdem.NODATA_VALUE
+        )
+        expected = expected[0]
+
+        with rasterio.open(dst_path) as f:
+            assert f.transform.almost_equals(transform)
             a = f.read(1)
-            assert np.isfinite(a).sum() > 0
+        assert a.shape == expected.shape
+        mask = a == jpgisdem.NODATA_VALUE
+        assert np.array_equal(mask, expected == jpgisdem.NODATA_VALUE)
+        max_z_error = jpgisdem.COG_PROFILE["max_z_error"]
+        np.testing.assert_allclose(a[~mask], expected[~mask], atol=2 * max_z_error)
+
+    def test_differing_resolutions(self):
+        headers = [
+            self._tile(0, 10, np.zeros((2, 2)))[:4],
+            self._tile(2, 10, np.zeros((4, 4)), res=0.5)[:4],
+        ]
+        with pytest.raises(click.ClickException, match="differing resolutions"):
+            jpgisdem._merge_extent(headers)
+
+    def test_overlap_keeps_first_valid_value(self):
+        nodata = jpgisdem.NODATA_VALUE
+        first = self._tile(0, 2, np.array([[1, 2, 3], [4, nodata, 6]]))
+        second = self._tile(1, 2, np.array([[20, 30, 40], [50, 60, 70]]))
+        tiles = [first, second]
+
+        extent = jpgisdem._merge_extent([tile[:4] for tile in tiles])
+        _, transform, height, width = extent
+        assert (height, width) == (2, 4)
+        assert transform.c == 0 and transform.f == 2
+
+        dest = jpgisdem._merge_tiles(extent, iter(tiles))
+        expected = np.array([[1, 2, 3, 40], [4, 50, 6, 70]], dtype=np.float32)
+        assert np.array_equal(dest, expected)
+
+
+class TestParseHeader:
+    GML = {
+        "low": "0 0",
+        "high": "1124 749",
+        "axisLabels": "x y",
+        "lowerCorner": "26.583333333 126.75",
+        "upperCorner": "26.666666667 126.875",
+        "startPoint": "743 639",
+    }
+
+    @pytest.mark.parametrize("sep", [" ", "  ", "\t", "\n", " \t "])
+    def test_whitespace(self, sep):
+        gml = {k: v.replace(" ", sep) for k, v in self.GML.items()}
+        gml = {k: f"{sep}{v}{sep}" for k, v in gml.items()}
+        assert jpgisdem._parse_shape(gml) == (750, 1125)
+        assert jpgisdem._parse_bounds(gml) == rasterio.coords.BoundingBox(
+            126.75, 26.583333333, 126.875, 26.666666667
+        )
+        assert jpgisdem._parse_start_index(gml, 1125) == 1125 * 639 + 743
+
+    @pytest.mark.parametrize(
+        "key, value, parse",
+        [
+            ("low", "0", jpgisdem._parse_shape),
+            ("high", "1124 749 0", jpgisdem._parse_shape),
+            ("axisLabels", "x y z", jpgisdem._parse_shape),
+            ("lowerCorner", "26.583333333", jpgisdem._parse_bounds),
+            ("upperCorner", "26.6 126.8 0", jpgisdem._parse_bounds),
+            (
+                "startPoint",
+                "743 639 1",
+                lambda gml: jpgisdem._parse_start_index(gml, 1),
+            ),
+        ],
+    )
+    def test_wrong_number_of_values(self, key, value, parse):
+        gml = dict(self.GML, **{key: value})
+        with pytest.raises(click.ClickException):
+            parse(gml)
+
+
+class TestLoadMainData:
+    def test_indented_with_trailing_whitespace(self):
+        gml = {
+            "tupleList": "\n\t\tその他,1.20\n\t\tデータなし,-9999.\n\t\t\t\t\n\t\t\t"
+        }
+        data = jpgisdem._load_main_data(gml)
+        assert data.dtype == np.float32
+        assert np.array_equal(data, np.array([1.2, -9999.0], dtype=np.float32))
+
+    def test_single_row(self):
+        data = jpgisdem._load_main_data({"tupleList": "\nその他,3.60\n"})
+        assert data.shape == (1,)
+        assert data[0] == np.float32(3.6)